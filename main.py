@@ -1,17 +1,27 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, make_response
+from markupsafe import Markup
 import psycopg2
 from psycopg2 import extras
 import hashlib
 import datetime
 from decimal import Decimal
+from collections import OrderedDict
+import click
+import gzip
 import os
 import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'seu_secret_key_aqui')
 
 # Função de conexão com o banco de dados do Vercel Postgres
-def get_db_connection():
+def get_db_connection(check_schema=True):
     db_url = os.environ.get('POSTGRES_URL')
     if not db_url:
         # Se a variável de ambiente não estiver configurada (local), use um padrão de desenvolvimento
@@ -20,8 +30,329 @@ def get_db_connection():
         raise Exception("POSTGRES_URL não está configurada. Configure a variável de ambiente no Vercel ou localmente.")
 
     conn = psycopg2.connect(db_url)
+    if check_schema:
+        try:
+            ensure_schema(conn)
+        except Exception:
+            conn.close()
+            raise
     return conn
 
+# Tabelas auxiliares da aplicação (o schema principal é criado remotamente). São criadas
+# pelo comando init-db, nunca durante uma requisição.
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        organization_id INTEGER PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS loans_archive (LIKE loans);
+    CREATE TABLE IF NOT EXISTS payments_archive (LIKE payments);
+    CREATE INDEX IF NOT EXISTS loans_archive_id_idx ON loans_archive (id);
+    CREATE INDEX IF NOT EXISTS loans_archive_client_idx ON loans_archive (client_id);
+    CREATE INDEX IF NOT EXISTS loans_archive_org_date_idx ON loans_archive (organization_id, loan_date);
+    CREATE INDEX IF NOT EXISTS payments_archive_loan_idx ON payments_archive (loan_id);
+    CREATE INDEX IF NOT EXISTS payments_archive_org_date_idx ON payments_archive (organization_id, payment_date);
+'''
+SCHEMA_TABLES = ('data_versions', 'loans_archive', 'payments_archive')
+
+_schema_ready = False
+
+def ensure_schema(conn):
+    """Confere, uma vez por processo, se init-db já criou as tabelas auxiliares."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur = conn.cursor()
+    cur.execute('SELECT ' + ', '.join(['to_regclass(%s)'] * len(SCHEMA_TABLES)), SCHEMA_TABLES)
+    missing = [table for table, oid in zip(SCHEMA_TABLES, cur.fetchone()) if oid is None]
+    if missing:
+        raise Exception(f"Tabelas ausentes: {', '.join(missing)}. Execute 'flask --app main init-db'.")
+    _schema_ready = True
+
+def init_db(conn):
+    """Cria as tabelas auxiliares e, se payments for particionada, as partições do mês
+    atual e dos próximos. Retorna False se alguma partição não pôde ser criada."""
+    cur = conn.cursor()
+    cur.execute(SCHEMA_SQL)
+    # A listagem de empréstimos filtra por organização e ordena por loan_date
+    if not table_has_index(cur, 'loans', ['organization_id', 'loan_date']):
+        cur.execute('CREATE INDEX loans_org_date_idx ON loans (organization_id, loan_date)')
+    ok = True
+    if payments_is_partitioned(cur):
+        ok = ensure_payment_partitions(cur)
+    conn.commit()
+    return ok
+
+# PARTICIONAMENTO DE PAGAMENTOS E ARQUIVAMENTO
+# ---
+# payments é particionada por mês de payment_date (payments_AAAA_MM), com uma
+# partição default para datas sem partição. As partições dos próximos meses são
+# criadas por init-db, partition-payments e archive-loans; rode um deles ao menos
+# uma vez por mês (até lá, os pagamentos novos caem na default). Empréstimos quitados há mais de
+# ARCHIVE_HORIZON_DAYS são movidos, com seus pagamentos, para loans_archive e
+# payments_archive; as rotas só consultam o arquivo quando o período pedido exige.
+PAYMENT_PARTITION_MONTHS_AHEAD = 3
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', '730'))
+ARCHIVE_BATCH_SIZE = 1000
+
+LOANS_WITH_ARCHIVE = '(SELECT * FROM loans UNION ALL SELECT * FROM loans_archive)'
+PAYMENTS_WITH_ARCHIVE = '(SELECT * FROM payments UNION ALL SELECT * FROM payments_archive)'
+
+def add_months(date, months):
+    month = date.month - 1 + months
+    return datetime.date(date.year + month // 12, month % 12 + 1, 1)
+
+def payments_is_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('payments')")
+    row = cur.fetchone()
+    return row is not None and row[0] == 'p'
+
+def create_payment_partition(cur, month):
+    """Cria a partição do mês. Pagamentos desse mês que já caíram na partição default
+    são movidos para ela; sem isso o PostgreSQL recusa a nova partição."""
+    name = f'payments_{month:%Y_%m}'
+    cur.execute('SELECT to_regclass(%s)', (name,))
+    if cur.fetchone()[0]:
+        return
+    bounds = (month, add_months(month, 1))
+    
+    cur.execute("SELECT to_regclass('payments_default')")
+    has_default = cur.fetchone()[0] is not None
+    if has_default:
+        cur.execute('SELECT EXISTS (SELECT 1 FROM payments_default WHERE payment_date >= %s AND payment_date < %s)', bounds)
+        has_default = cur.fetchone()[0]
+    
+    if not has_default:
+        cur.execute(f'CREATE TABLE {name} PARTITION OF payments FOR VALUES FROM (%s) TO (%s)', bounds)
+        return
+    
+    cur.execute(f'CREATE TABLE {name} (LIKE payments INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cur.execute(f'''
+        WITH moved AS (
+            DELETE FROM payments_default WHERE payment_date >= %s AND payment_date < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', bounds)
+    cur.execute(f'ALTER TABLE payments ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+
+def ensure_payment_partitions(cur, months_ahead=PAYMENT_PARTITION_MONTHS_AHEAD):
+    """Cria as partições do mês atual e dos próximos meses, cada uma em seu próprio
+    savepoint. Retorna False se alguma não pôde ser criada."""
+    current_month = datetime.date.today().replace(day=1)
+    ok = True
+    for i in range(months_ahead + 1):
+        month = add_months(current_month, i)
+        cur.execute('SAVEPOINT payment_partition')
+        try:
+            create_payment_partition(cur, month)
+            cur.execute('RELEASE SAVEPOINT payment_partition')
+        except psycopg2.Error as e:
+            cur.execute('ROLLBACK TO SAVEPOINT payment_partition')
+            app.logger.warning(f'Não foi possível criar a partição de pagamentos de {month:%Y-%m}: {e}')
+            ok = False
+    return ok
+
+def partition_payments(conn):
+    """Converte payments em tabela particionada por mês. Retorna False se já estiver particionada."""
+    cur = conn.cursor()
+    if payments_is_partitioned(cur):
+        return False
+    
+    cur.execute("SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = 'payments'::regclass AND contype = 'f'")
+    foreign_keys = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = 'payments'::regclass AND NOT indisprimary")
+    indexes = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT attidentity <> '' FROM pg_attribute WHERE attrelid = 'payments'::regclass AND attname = 'id'")
+    is_identity = cur.fetchone()[0]
+    cur.execute("SELECT pg_get_serial_sequence('payments', 'id')")
+    sequence = cur.fetchone()[0]
+    cur.execute('SELECT MIN(payment_date), MAX(payment_date) FROM payments')
+    first_date, last_date = cur.fetchone()
+    
+    today = datetime.date.today()
+    cur.execute('ALTER TABLE payments RENAME TO payments_unpartitioned')
+    cur.execute('''
+        CREATE TABLE payments (
+            LIKE payments_unpartitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS
+        ) PARTITION BY RANGE (payment_date)
+    ''')
+    cur.execute('CREATE TABLE payments_default PARTITION OF payments DEFAULT')
+    
+    month = (first_date or today).replace(day=1)
+    last_month = add_months(max(last_date or today, today).replace(day=1), PAYMENT_PARTITION_MONTHS_AHEAD)
+    while month <= last_month:
+        create_payment_partition(cur, month)
+        month = add_months(month, 1)
+    
+    if is_identity:
+        # A coluna identity nova tem sua própria sequência, que precisa continuar de onde a antiga parou
+        cur.execute('INSERT INTO payments OVERRIDING SYSTEM VALUE SELECT * FROM payments_unpartitioned')
+        cur.execute("SELECT setval(pg_get_serial_sequence('payments', 'id'), MAX(id)) FROM payments HAVING MAX(id) IS NOT NULL")
+    else:
+        cur.execute('INSERT INTO payments SELECT * FROM payments_unpartitioned')
+        if sequence:
+            cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY payments.id')
+    cur.execute('DROP TABLE payments_unpartitioned')
+    
+    # A chave primária de uma tabela particionada precisa incluir a coluna de partição
+    cur.execute('ALTER TABLE payments ADD PRIMARY KEY (id, payment_date)')
+    for foreign_key in foreign_keys:
+        cur.execute(f'ALTER TABLE payments ADD {foreign_key}')
+    
+    # Índices únicos sem payment_date não podem existir numa tabela particionada
+    for index in indexes:
+        cur.execute('SAVEPOINT payment_index')
+        try:
+            cur.execute(index)
+            cur.execute('RELEASE SAVEPOINT payment_index')
+        except psycopg2.Error as e:
+            cur.execute('ROLLBACK TO SAVEPOINT payment_index')
+            app.logger.warning(f'Índice de payments não recriado ({index}): {e}')
+    
+    if not table_has_index(cur, 'payments', ['loan_id']):
+        cur.execute('CREATE INDEX payments_loan_idx ON payments (loan_id)')
+    if not table_has_index(cur, 'payments', ['organization_id', 'payment_date']):
+        cur.execute('CREATE INDEX payments_org_date_idx ON payments (organization_id, payment_date)')
+    conn.commit()
+    return True
+
+def table_has_index(cur, table, columns):
+    """Indica se algum índice da tabela começa pelas colunas dadas, na mesma ordem."""
+    cur.execute('''
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = %s::regclass
+            AND (SELECT array_agg(a.attname::text ORDER BY k.ord)
+                 FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                 WHERE k.ord <= %s) = %s::text[]
+        )
+    ''', (table, len(columns), columns))
+    return cur.fetchone()[0]
+
+def drop_empty_payment_partitions(cur, before):
+    """Remove partições mensais vazias que terminam antes de `before`. Mantém payments
+    bloqueada até o commit do chamador."""
+    cur.execute('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'payments'::regclass
+    ''')
+    candidates = []
+    for (name,) in cur.fetchall():
+        match = re.fullmatch(r'payments_(\d{4})_(\d{2})', name)
+        if not match:
+            continue
+        month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+        if add_months(month, 1) <= before:
+            candidates.append(name)
+    if not candidates:
+        return 0
+
+    # O bloqueio vem antes da verificação, para que um pagamento retroativo não seja
+    # gravado na partição entre o EXISTS e o DROP. A tabela pai é bloqueada primeiro,
+    # na mesma ordem em que um INSERT bloqueia pai e partição, evitando deadlock.
+    cur.execute('LOCK TABLE payments IN ACCESS EXCLUSIVE MODE')
+    dropped = 0
+    for name in candidates:
+        cur.execute(f'LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE')
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM {name})')
+        if not cur.fetchone()[0]:
+            cur.execute(f'DROP TABLE {name}')
+            dropped += 1
+    return dropped
+
+def archive_settled_loans(conn, horizon_days=ARCHIVE_HORIZON_DAYS):
+    """Move empréstimos quitados sem pagamentos dentro do horizonte para as tabelas de arquivo."""
+    cutoff = datetime.date.today() - datetime.timedelta(days=horizon_days)
+    cur = conn.cursor()
+    archived = 0
+    
+    while True:
+        cur.execute('''
+            SELECT l.id FROM loans l
+            WHERE l.status = 'paid' AND l.loan_date < %s
+            AND NOT EXISTS (SELECT 1 FROM payments p WHERE p.loan_id = l.id AND p.payment_date >= %s)
+            ORDER BY l.id
+            LIMIT %s
+            FOR UPDATE
+        ''', (cutoff, cutoff, ARCHIVE_BATCH_SIZE))
+        loan_ids = [row[0] for row in cur.fetchall()]
+        if not loan_ids:
+            break
+        
+        # Cada movimentação é um único comando (DELETE ... RETURNING), para que nenhuma
+        # linha confirmada entre a cópia e a remoção se perca
+        cur.execute('''
+            WITH moved AS (DELETE FROM payments WHERE loan_id = ANY(%s) RETURNING *)
+            INSERT INTO payments_archive SELECT * FROM moved
+        ''', (loan_ids,))
+        cur.execute('''
+            WITH moved AS (DELETE FROM loans WHERE id = ANY(%s) RETURNING *)
+            INSERT INTO loans_archive SELECT * FROM moved RETURNING organization_id
+        ''', (loan_ids,))
+        for org_id in {row[0] for row in cur.fetchall()}:
+            bump_data_version(cur, org_id)
+        conn.commit()
+        archived += len(loan_ids)
+    
+    dropped = 0
+    if payments_is_partitioned(cur):
+        dropped = drop_empty_payment_partitions(cur, cutoff.replace(day=1))
+        conn.commit()
+    return archived, dropped
+
+def archive_has_rows(cur, table, date_column, org_id, start=None, end=None):
+    filters = ['organization_id = %s']
+    params = [org_id]
+    if start:
+        filters.append(f'{date_column} >= %s')
+        params.append(start)
+    if end:
+        filters.append(f'{date_column} <= %s')
+        params.append(end)
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE {' AND '.join(filters)})", params)
+    return cur.fetchone()[0]
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria as tabelas auxiliares e as partições de pagamentos dos próximos meses."""
+    conn = get_db_connection(check_schema=False)
+    try:
+        if init_db(conn):
+            click.echo('Tabelas auxiliares e partições prontas.')
+        else:
+            raise click.ClickException('Não foi possível criar todas as partições de pagamentos.')
+    finally:
+        conn.close()
+
+@app.cli.command('partition-payments')
+def partition_payments_command():
+    """Converte a tabela payments em partições mensais por payment_date."""
+    conn = get_db_connection(check_schema=False)
+    try:
+        init_db(conn)
+        if partition_payments(conn):
+            click.echo('Tabela payments particionada por mês.')
+        else:
+            click.echo('Tabela payments já está particionada.')
+    finally:
+        conn.close()
+
+@app.cli.command('archive-loans')
+@click.option('--horizon-days', default=ARCHIVE_HORIZON_DAYS, show_default=True,
+              help='Arquivar empréstimos quitados sem pagamentos neste número de dias.')
+def archive_loans_command(horizon_days):
+    """Move empréstimos quitados antigos para loans_archive e payments_archive."""
+    conn = get_db_connection(check_schema=False)
+    try:
+        init_db(conn)
+        archived, dropped = archive_settled_loans(conn, horizon_days)
+        click.echo(f'{archived} empréstimo(s) arquivado(s), {dropped} partição(ões) vazia(s) removida(s).')
+    finally:
+        conn.close()
+
 # Funções auxiliares (Middleware, etc.)
 def login_required(f):
     from functools import wraps
@@ -45,6 +376,113 @@ def master_required(f):
 def get_user_organization():
     return session.get('organization_id')
 
+# VERSÃO DOS DADOS E CACHE DE FRAGMENTOS
+# ---
+# Cada organização tem um contador de versão incrementado em toda escrita.
+# Os dados do painel admin (usuários e cobranças) usam um escopo próprio.
+ADMIN_DATA_SCOPE = -1
+PAGE_SIZE = 50
+FRAGMENT_CACHE_SIZE = 256
+
+_fragment_cache = OrderedDict()
+_fragment_cache_lock = threading.Lock()
+
+def get_data_version(cur, scope):
+    cur.execute('SELECT version FROM data_versions WHERE organization_id = %s', (scope,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def bump_data_version(cur, scope):
+    cur.execute('''
+        INSERT INTO data_versions (organization_id, version) VALUES (%s, 1)
+        ON CONFLICT (organization_id) DO UPDATE SET version = data_versions.version + 1
+    ''', (scope,))
+
+def get_page_args():
+    page = max(request.args.get('page', 1, type=int), 1)
+    search = request.args.get('q', '').strip()
+    return page, search
+
+def get_date_range_args():
+    def parse(name):
+        try:
+            return datetime.datetime.strptime(request.args.get(name, ''), '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    return parse('start'), parse('end')
+
+def render_rows_cached(cur, template, scope, key, load_rows):
+    """Renderiza o <tbody> de uma tabela paginada, reaproveitando o HTML enquanto
+    a versão dos dados do escopo não mudar. Retorna (html, has_next)."""
+    cache_key = (template, scope, get_data_version(cur, scope), datetime.date.today()) + key
+    with _fragment_cache_lock:
+        cached = _fragment_cache.get(cache_key)
+        if cached is not None:
+            _fragment_cache.move_to_end(cache_key)
+            return cached
+
+    rows = load_rows()
+    has_next = len(rows) > PAGE_SIZE
+    html = Markup(render_template(template, rows=rows[:PAGE_SIZE]))
+
+    with _fragment_cache_lock:
+        _fragment_cache[cache_key] = (html, has_next)
+        while len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+    return html, has_next
+
+def rows_response(html, has_next):
+    response = make_response(html)
+    response.headers['X-Has-Next'] = '1' if has_next else '0'
+    return response
+
+# COMPRESSÃO E ETAG
+# ---
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json'}
+MIN_COMPRESS_SIZE = 500
+
+def negotiate_encoding(accept_encodings):
+    # Qualidade 0 (por exemplo "gzip;q=0") significa que o cliente recusa a codificação
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = negotiate_encoding(request.accept_encodings)
+
+    # ETag forte calculada sobre o corpo original; cada codificação recebe um sufixo
+    # para que representações comprimidas diferentes nunca compartilhem a mesma tag.
+    etag = hashlib.sha1(body).hexdigest()
+    if encoding:
+        etag = f'{etag}-{encoding}'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if not response.cache_control.max_age:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    response.make_conditional(request)
+    if response.status_code == 304 or not encoding:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=6, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 # ROTAS DE AUTENTICAÇÃO
 # ---
 @app.route('/login', methods=['GET', 'POST'])
@@ -103,22 +541,13 @@ def admin_panel():
     ''')
     organizations = cur.fetchall()
     
-    # Buscar usuários com informações de cobrança
-    cur.execute('''
-        SELECT u.*, o.name as org_name,
-               ub.status as payment_status,
-               ub.payment_date as last_payment,
-               CASE 
-                   WHEN u.start_date <= date_trunc('month', NOW()) THEN 'active'
-                   ELSE 'future'
-               END as billing_status
-        FROM users u 
-        JOIN organizations o ON u.organization_id = o.id 
-        LEFT JOIN user_billing ub ON u.id = ub.user_id AND ub.month_year = %s
-        WHERE u.role != 'master'
-        ORDER BY o.name, u.username
-    ''', (current_month,))
-    users = cur.fetchall()
+    # Buscar usuários com informações de cobrança (apenas a primeira página)
+    users_html, has_next = render_rows_cached(
+        cur, '_admin_users_rows.html', ADMIN_DATA_SCOPE, (1, ''),
+        lambda: fetch_admin_users_page(cur, 1, ''))
+    
+    cur.execute("SELECT COUNT(*) as count FROM users WHERE role != 'master'")
+    user_count = cur.fetchone()
     
     # Calcular estatísticas
     cur.execute('''
@@ -150,11 +579,51 @@ def admin_panel():
     
     return render_template('admin_panel.html', 
                           organizations=organizations, 
-                          users=users,
+                          users_html=users_html,
+                          has_next=has_next,
+                          user_count=user_count['count'],
                           monthly_revenue=float(monthly_revenue['total']) if monthly_revenue and monthly_revenue['total'] else 0,
                           overdue_payments=overdue_payments['count'],
                           recent_payments=recent_payments)
 
+def fetch_admin_users_page(cur, page, search):
+    current_month = datetime.date.today().strftime('%Y-%m')
+    filters = ["u.role != 'master'"]
+    params = [current_month]
+    if search:
+        filters.append('(u.username ILIKE %s OR o.name ILIKE %s)')
+        params += [f'%{search}%', f'%{search}%']
+    
+    cur.execute(f'''
+        SELECT u.*, o.name as org_name,
+               ub.status as payment_status,
+               ub.payment_date as last_payment,
+               CASE 
+                   WHEN u.start_date <= date_trunc('month', NOW()) THEN 'active'
+                   ELSE 'future'
+               END as billing_status
+        FROM users u 
+        JOIN organizations o ON u.organization_id = o.id 
+        LEFT JOIN user_billing ub ON u.id = ub.user_id AND ub.month_year = %s
+        WHERE {' AND '.join(filters)}
+        ORDER BY o.name, u.username
+        LIMIT %s OFFSET %s
+    ''', params + [PAGE_SIZE + 1, (page - 1) * PAGE_SIZE])
+    return cur.fetchall()
+
+@app.route('/admin/users/rows')
+@master_required
+def admin_users_rows():
+    page, search = get_page_args()
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    html, has_next = render_rows_cached(
+        cur, '_admin_users_rows.html', ADMIN_DATA_SCOPE, (page, search),
+        lambda: fetch_admin_users_page(cur, page, search))
+    conn.close()
+    
+    return rows_response(html, has_next)
+
 @app.route('/admin/mark_payment_paid/<int:user_id>', methods=['POST'])
 @master_required
 def mark_payment_paid(user_id):
@@ -179,6 +648,7 @@ def mark_payment_paid(user_id):
             ON CONFLICT (user_id, month_year) DO UPDATE SET amount = EXCLUDED.amount, payment_date = EXCLUDED.payment_date, status = 'paid'
         ''', (user_id, current_month, user['monthly_fee'], datetime.date.today(), user['start_date']))
         
+        bump_data_version(cur, ADMIN_DATA_SCOPE)
         conn.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -193,12 +663,19 @@ def delete_user(user_id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
+        cur.execute('SELECT organization_id FROM users WHERE id = %s', (user_id,))
+        user = cur.fetchone()
+        if user:
+            bump_data_version(cur, user[0])
         cur.execute('DELETE FROM user_billing WHERE user_id = %s', (user_id,))
         cur.execute('DELETE FROM payments WHERE organization_id = (SELECT organization_id FROM users WHERE id = %s)', (user_id,))
+        cur.execute('DELETE FROM payments_archive WHERE organization_id = (SELECT organization_id FROM users WHERE id = %s)', (user_id,))
         cur.execute('DELETE FROM loans WHERE organization_id = (SELECT organization_id FROM users WHERE id = %s)', (user_id,))
+        cur.execute('DELETE FROM loans_archive WHERE organization_id = (SELECT organization_id FROM users WHERE id = %s)', (user_id,))
         cur.execute('DELETE FROM clients WHERE organization_id = (SELECT organization_id FROM users WHERE id = %s)', (user_id,))
         cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
         
+        bump_data_version(cur, ADMIN_DATA_SCOPE)
         conn.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -220,6 +697,7 @@ def update_user_fee(user_id):
     cur = conn.cursor()
     try:
         cur.execute('UPDATE users SET monthly_fee = %s WHERE id = %s', (monthly_fee, user_id))
+        bump_data_version(cur, ADMIN_DATA_SCOPE)
         conn.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -253,6 +731,7 @@ def mark_all_payments_paid():
                 ON CONFLICT (user_id, month_year) DO UPDATE SET amount = EXCLUDED.amount, payment_date = EXCLUDED.payment_date, status = 'paid'
             ''', (user['id'], user['monthly_fee'], datetime.date.today(), current_month, user['start_date']))
         
+        bump_data_version(cur, ADMIN_DATA_SCOPE)
         conn.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -287,6 +766,7 @@ def create_user():
                 VALUES (%s, %s, 'user', %s, %s, %s)
             ''', (username, password, org_id, monthly_fee, start_date))
             
+            bump_data_version(cur, ADMIN_DATA_SCOPE)
             conn.commit()
             flash(f'Usuário {username} criado com sucesso! Valor mensal: R$ {monthly_fee:.2f}')
             return redirect(url_for('admin_panel'))
@@ -330,7 +810,10 @@ def dashboard():
     result = cur.fetchone()
     stats['total_to_receive'] = float(result['total']) if result and result['total'] else 0
     
-    cur.execute('SELECT SUM(amount) as total FROM payments WHERE organization_id = %s', (org_id,))
+    cur.execute('''
+        SELECT (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE organization_id = %s)
+             + (SELECT COALESCE(SUM(amount), 0) FROM payments_archive WHERE organization_id = %s) as total
+    ''', (org_id, org_id))
     result = cur.fetchone()
     stats['total_received'] = float(result['total']) if result and result['total'] else 0
     
@@ -367,26 +850,53 @@ def dashboard():
                           upcoming_loans=upcoming_loans,
                           overdue_loans=overdue_loans)
 
-@app.route('/clients')
-@login_required
-def clients():
-    org_id = get_user_organization()
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=extras.DictCursor)
-    cur.execute('''
+def fetch_clients_page(cur, org_id, page, search):
+    filters = ['c.organization_id = %s']
+    params = [org_id, org_id]
+    if search:
+        filters.append('''(c.full_name ILIKE %s OR c.document ILIKE %s OR c.phone ILIKE %s
+                         OR c.email ILIKE %s OR c.address ILIKE %s)''')
+        params += [f'%{search}%'] * 5
+    
+    cur.execute(f'''
         SELECT c.*, 
-               COUNT(l.id) as loan_count,
+               COUNT(l.id) + (SELECT COUNT(*) FROM loans_archive la WHERE la.client_id = c.id) as loan_count,
                SUM(CASE WHEN l.status = 'active' THEN l.total_amount ELSE 0 END) as total_debt
         FROM clients c
         LEFT JOIN loans l ON c.id = l.client_id AND l.organization_id = %s
-        WHERE c.organization_id = %s
+        WHERE {' AND '.join(filters)}
         GROUP BY c.id
         ORDER BY c.full_name
-    ''', (org_id, org_id))
-    clients = cur.fetchall()
+        LIMIT %s OFFSET %s
+    ''', params + [PAGE_SIZE + 1, (page - 1) * PAGE_SIZE])
+    return cur.fetchall()
+
+@app.route('/clients')
+@login_required
+def clients():
+    org_id = get_user_organization()
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    clients_html, has_next = render_rows_cached(
+        cur, '_clients_rows.html', org_id, (1, ''),
+        lambda: fetch_clients_page(cur, org_id, 1, ''))
+    conn.close()
+    
+    return render_template('clients.html', clients_html=clients_html, has_next=has_next)
+
+@app.route('/clients/rows')
+@login_required
+def clients_rows():
+    org_id = get_user_organization()
+    page, search = get_page_args()
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    html, has_next = render_rows_cached(
+        cur, '_clients_rows.html', org_id, (page, search),
+        lambda: fetch_clients_page(cur, org_id, page, search))
     conn.close()
     
-    return render_template('clients.html', clients=clients)
+    return rows_response(html, has_next)
 
 @app.route('/add_client', methods=['GET', 'POST'])
 @login_required
@@ -407,6 +917,7 @@ def add_client():
                 request.form['address'],
                 org_id
             ))
+            bump_data_version(cur, org_id)
             conn.commit()
             flash('Cliente cadastrado com sucesso!')
             return redirect(url_for('clients'))
@@ -421,24 +932,45 @@ def add_client():
     
     return render_template('add_client.html')
 
-@app.route('/loans')
-@login_required
-def loans():
-    org_id = get_user_organization()
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=extras.DictCursor)
-    cur.execute('''
+def fetch_loans_page(cur, org_id, page, status, search, start=None, end=None, archived=False):
+    filters = ['l.organization_id = %s']
+    params = [org_id]
+    if status in ('active', 'paid'):
+        filters.append('l.status = %s')
+        params.append(status)
+    if search:
+        # Os valores aparecem formatados na tela (R$ 1.200,00), então "1.200,00" também
+        # deve encontrar 1200.00
+        amounts = [f'%{search}%', f"%{search.replace('.', '').replace(',', '.')}%"]
+        filters.append('''(c.full_name ILIKE %s OR c.document ILIKE %s
+                         OR CAST(l.amount AS TEXT) LIKE ANY(%s) OR CAST(l.total_amount AS TEXT) LIKE ANY(%s)
+                         OR to_char(l.due_date, 'YYYY-MM-DD') LIKE %s)''')
+        params += [f'%{search}%', f'%{search}%', amounts, amounts, f'%{search}%']
+    if start:
+        filters.append('l.loan_date >= %s')
+        params.append(start)
+    if end:
+        filters.append('l.loan_date <= %s')
+        params.append(end)
+    
+    # A listagem padrão mostra só empréstimos em uso. Os arquivados (todos quitados) entram
+    # quando pedidos explicitamente ou quando o período filtrado alcança o arquivo
+    loans_source, payments_source = 'loans', 'payments'
+    if (status != 'active' and (archived or start or end)
+            and archive_has_rows(cur, 'loans_archive', 'loan_date', org_id, start, end)):
+        loans_source, payments_source = LOANS_WITH_ARCHIVE, PAYMENTS_WITH_ARCHIVE
+    
+    # O saldo restante é calculado apenas para os empréstimos da página
+    cur.execute(f'''
         SELECT l.*, c.full_name, c.document,
-               (l.total_amount - COALESCE(SUM(p.amount), 0)) as remaining_amount
-        FROM loans l
+               (l.total_amount - COALESCE((SELECT SUM(p.amount) FROM {payments_source} p WHERE p.loan_id = l.id), 0)) as remaining_amount
+        FROM {loans_source} l
         JOIN clients c ON l.client_id = c.id
-        LEFT JOIN payments p ON l.id = p.loan_id
-        WHERE l.organization_id = %s
-        GROUP BY l.id
-        ORDER BY l.loan_date DESC
-    ''', (org_id,))
+        WHERE {' AND '.join(filters)}
+        ORDER BY l.loan_date DESC, l.id DESC
+        LIMIT %s OFFSET %s
+    ''', params + [PAGE_SIZE + 1, (page - 1) * PAGE_SIZE])
     loans = cur.fetchall()
-    conn.close()
     
     loans_list = []
     today = datetime.date.today()
@@ -452,7 +984,37 @@ def loans():
             loan_dict['is_overdue'] = False
         loans_list.append(loan_dict)
     
-    return render_template('loans.html', loans=loans_list)
+    return loans_list
+
+@app.route('/loans')
+@login_required
+def loans():
+    org_id = get_user_organization()
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    loans_html, has_next = render_rows_cached(
+        cur, '_loans_rows.html', org_id, (1, '', '', None, None, False),
+        lambda: fetch_loans_page(cur, org_id, 1, '', ''))
+    conn.close()
+    
+    return render_template('loans.html', loans_html=loans_html, has_next=has_next)
+
+@app.route('/loans/rows')
+@login_required
+def loans_rows():
+    org_id = get_user_organization()
+    page, search = get_page_args()
+    start, end = get_date_range_args()
+    status = request.args.get('status', '')
+    archived = request.args.get('archived') == '1'
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    html, has_next = render_rows_cached(
+        cur, '_loans_rows.html', org_id, (page, status, search, start, end, archived),
+        lambda: fetch_loans_page(cur, org_id, page, status, search, start, end, archived))
+    conn.close()
+    
+    return rows_response(html, has_next)
 
 @app.route('/add_loan', methods=['GET', 'POST'])
 @login_required
@@ -488,6 +1050,7 @@ def add_loan():
               installments, installment_amount, total_amount, 
               loan_date, due_date, org_id))
         
+        bump_data_version(cur, org_id)
         conn.commit()
         conn.close()
         flash('Empréstimo cadastrado com sucesso!')
@@ -507,35 +1070,36 @@ def loan_detail(loan_id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
     
-    cur.execute('''
-        SELECT l.*, c.full_name, c.document, c.phone, c.email
-        FROM loans l
-        JOIN clients c ON l.client_id = c.id
-        WHERE l.id = %s AND l.organization_id = %s
-    ''', (loan_id, org_id))
-    loan = cur.fetchone()
+    # Empréstimos quitados antigos podem ter sido movidos para o arquivo
+    loan = None
+    for loans_table, payments_table in (('loans', 'payments'), ('loans_archive', 'payments_archive')):
+        cur.execute(f'''
+            SELECT l.*, c.full_name, c.document, c.phone, c.email
+            FROM {loans_table} l
+            JOIN clients c ON l.client_id = c.id
+            WHERE l.id = %s AND l.organization_id = %s
+        ''', (loan_id, org_id))
+        loan = cur.fetchone()
+        if loan:
+            break
     
-    cur.execute('''
-        SELECT * FROM payments 
+    if not loan:
+        conn.close()
+        flash('Empréstimo não encontrado!')
+        return redirect(url_for('loans'))
+    
+    cur.execute(f'''
+        SELECT * FROM {payments_table} 
         WHERE loan_id = %s 
         ORDER BY payment_date DESC
     ''', (loan_id,))
     payments = cur.fetchall()
     
-    cur.execute('''
-        SELECT SUM(amount) as total 
-        FROM payments 
-        WHERE loan_id = %s
-    ''', (loan_id,))
-    total_paid = cur.fetchone()
-    
     conn.close()
     
-    if not loan:
-        flash('Empréstimo não encontrado!')
-        return redirect(url_for('loans'))
-    
-    remaining = float(loan['total_amount']) - (float(total_paid['total']) if total_paid and total_paid['total'] else 0)
+    # Soma feita a partir das linhas já carregadas, evitando uma segunda varredura das partições
+    total_paid = float(sum(payment['amount'] for payment in payments))
+    remaining = float(loan['total_amount']) - total_paid
     
     today = datetime.date.today()
     due_date = loan['due_date']
@@ -544,7 +1108,7 @@ def loan_detail(loan_id):
     return render_template('loan_detail.html', 
                           loan=loan, 
                           payments=payments, 
-                          total_paid=float(total_paid['total']) if total_paid and total_paid['total'] else 0,
+                          total_paid=total_paid,
                           remaining=remaining,
                           is_overdue=is_overdue)
 
@@ -564,19 +1128,26 @@ def add_payment(loan_id):
     
     conn = get_db_connection()
     cur = conn.cursor()
+    # FOR SHARE impede que o job de arquivamento mova o empréstimo durante o pagamento
+    cur.execute('SELECT total_amount FROM loans WHERE id = %s FOR SHARE', (loan_id,))
+    loan = cur.fetchone()
+    if not loan:
+        conn.close()
+        flash('Empréstimo não encontrado!')
+        return redirect(url_for('loans'))
+    
     cur.execute('''
         INSERT INTO payments (loan_id, amount, payment_type, payment_date, notes, organization_id)
         VALUES (%s, %s, %s, %s, %s, %s)
     ''', (loan_id, amount, payment_type, payment_date, notes, org_id))
     
-    cur.execute('SELECT total_amount FROM loans WHERE id = %s', (loan_id,))
-    loan = cur.fetchone()
     cur.execute('SELECT SUM(amount) as total FROM payments WHERE loan_id = %s', (loan_id,))
     total_paid = cur.fetchone()
     
     if total_paid and total_paid[0] and float(total_paid[0]) >= float(loan[0]):
         cur.execute('UPDATE loans SET status = %s WHERE id = %s', ('paid', loan_id))
     
+    bump_data_version(cur, org_id)
     conn.commit()
     conn.close()
     
@@ -588,31 +1159,52 @@ def add_payment(loan_id):
 @login_required
 def api_profit_data():
     org_id = get_user_organization()
+    start, end = get_date_range_args()
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
     
-    cur.execute('''
+    # Sem período, o relatório cobre todo o histórico e inclui o arquivo se houver
+    loan_filters = ['l.organization_id = %s']
+    payment_filters = ['p.organization_id = %s']
+    params = [org_id]
+    if start:
+        loan_filters.append('l.loan_date >= %s')
+        payment_filters.append('p.payment_date >= %s')
+        params.append(start)
+    if end:
+        loan_filters.append('l.loan_date <= %s')
+        payment_filters.append('p.payment_date <= %s')
+        params.append(end)
+    
+    loans_source = 'loans'
+    if archive_has_rows(cur, 'loans_archive', 'loan_date', org_id, start, end):
+        loans_source = LOANS_WITH_ARCHIVE
+    payments_source = 'payments'
+    if archive_has_rows(cur, 'payments_archive', 'payment_date', org_id, start, end):
+        payments_source = PAYMENTS_WITH_ARCHIVE
+    
+    cur.execute(f'''
         SELECT 
             EXTRACT(YEAR FROM l.loan_date) as year,
             EXTRACT(MONTH FROM l.loan_date) as month,
             SUM(l.amount) as total_lent,
             COUNT(l.id) as loan_count
-        FROM loans l
-        WHERE l.organization_id = %s
+        FROM {loans_source} l
+        WHERE {' AND '.join(loan_filters)}
         GROUP BY EXTRACT(YEAR FROM l.loan_date), EXTRACT(MONTH FROM l.loan_date)
         ORDER BY year DESC, month DESC
-    ''', (org_id,))
+    ''', params)
     monthly_data = cur.fetchall()
     
-    cur.execute('''
+    cur.execute(f'''
         SELECT 
             EXTRACT(YEAR FROM p.payment_date) as year,
             EXTRACT(MONTH FROM p.payment_date) as month,
             SUM(p.amount) as total_received
-        FROM payments p
-        WHERE p.organization_id = %s
+        FROM {payments_source} p
+        WHERE {' AND '.join(payment_filters)}
         GROUP BY EXTRACT(YEAR FROM p.payment_date), EXTRACT(MONTH FROM p.payment_date)
-    ''', (org_id,))
+    ''', params)
     payment_data = cur.fetchall()
     
     conn.close()
@@ -656,21 +1248,30 @@ def api_dashboard_stats():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
     
-    cur.execute('''
+    # Com um horizonte de arquivamento curto, parte dos últimos 12 meses pode estar no arquivo
+    start = add_months(datetime.date.today().replace(day=1), -12)
+    loans_source = 'loans'
+    if archive_has_rows(cur, 'loans_archive', 'loan_date', org_id, start):
+        loans_source = LOANS_WITH_ARCHIVE
+    payments_source = 'payments'
+    if archive_has_rows(cur, 'payments_archive', 'payment_date', org_id, start):
+        payments_source = PAYMENTS_WITH_ARCHIVE
+    
+    cur.execute(f'''
         SELECT to_char(loan_date, 'YYYY-MM') as month,
                SUM(amount) as total_amount,
                COUNT(*) as loan_count
-        FROM loans
+        FROM {loans_source} l
         WHERE loan_date >= date_trunc('month', NOW() - INTERVAL '12 months') AND organization_id = %s
         GROUP BY month
         ORDER BY month
     ''', (org_id,))
     monthly_loans = cur.fetchall()
     
-    cur.execute('''
+    cur.execute(f'''
         SELECT to_char(payment_date, 'YYYY-MM') as month,
                SUM(amount) as total_amount
-        FROM payments
+        FROM {payments_source} p
         WHERE payment_date >= date_trunc('month', NOW() - INTERVAL '12 months') AND organization_id = %s
         GROUP BY month
         ORDER BY month